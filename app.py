@@ -6,14 +6,21 @@ Industry-standard interface for PDF meal counting automation
 
 import streamlit as st
 import fitz
-import re
+import gc
 from collections import defaultdict, OrderedDict
 from typing import Dict, List
 import tempfile
 import os
+import shutil
 from pathlib import Path
 import zipfile
-import io
+
+from meal_counter_automation import TEXT_FLAGS
+from meal_parse import DATE_HEAD, is_dmy
+
+
+# Approximate glyph width of the totals font, used to size the centred text box
+_CHAR_WIDTH = 9.6
 
 
 # Page configuration
@@ -42,7 +49,7 @@ class MealCounter:
             return []
         
         page = doc[0]
-        text = page.get_text()
+        text = page.get_text("text", sort=False, flags=TEXT_FLAGS)
         lines = text.split('\n')
         
         meals_found = OrderedDict()
@@ -56,7 +63,8 @@ class MealCounter:
                 continue
             
             # Look for school name pattern - meals come after this
-            if 'spryfield' in line.lower() or ('central' in line.lower() and len(line) < 30):
+            line_lower = line.lower()
+            if 'spryfield' in line_lower or ('central' in line_lower and len(line) < 30):
                 # Check next few lines for meal
                 for j in range(i + 1, min(i + 10, len(lines))):
                     potential_meal = lines[j].strip()
@@ -64,15 +72,16 @@ class MealCounter:
                     # Skip empty, dates, numbers, headers
                     if not potential_meal:
                         continue
-                    if re.match(r'^\d+$', potential_meal):
+                    if potential_meal.isdecimal():
                         continue
-                    if re.match(r'\d{2}\s+\w+', potential_meal):
+                    if DATE_HEAD.match(potential_meal):
                         continue
-                    if potential_meal.lower() in ['date', 'school', 'meal', 'quantity', 'grade', 'class', 'diner', 'extra meal', 'cycle 5', 'cycle', 'about:blank']:
+                    potential_lower = potential_meal.lower()
+                    if potential_lower in ['date', 'school', 'meal', 'quantity', 'grade', 'class', 'diner', 'extra meal', 'cycle 5', 'cycle', 'about:blank']:
                         continue
-                    if 'spryfield' in potential_meal.lower():
+                    if 'spryfield' in potential_lower:
                         continue
-                    if re.match(r'\d{2}/\d{2}/\d{2}', potential_meal):
+                    if is_dmy(potential_meal):
                         continue
                     
                     # This might be a meal name
@@ -81,13 +90,13 @@ class MealCounter:
                     # Check if next line is part of meal name (multi-line meal)
                     if j + 1 < len(lines):
                         next_line = lines[j + 1].strip()
-                        if next_line and not re.match(r'^\d+$', next_line) and next_line.lower() not in ['extra meal', 'diner', 'class', 'grade']:
+                        if next_line and not next_line.isdecimal() and next_line.lower() not in ['extra meal', 'diner', 'class', 'grade']:
                             meal_name += ' ' + next_line
                     
                     # Check if there's a quantity after this (to confirm it's a meal)
                     has_quantity = False
                     for k in range(j + 1, min(j + 4, len(lines))):
-                        if re.match(r'^\d+$', lines[k].strip()):
+                        if lines[k].strip().isdecimal():
                             has_quantity = True
                             break
                     
@@ -105,8 +114,15 @@ class MealCounter:
         Extract meal quantities from a page using the detected meal types
         Uses exact full meal names
         """
-        text = page.get_text()
-        lines = text.split('\n')
+        text = page.get_text("text", sort=False, flags=TEXT_FLAGS)
+        
+        # Meal lines start with the first word of a meal type; skip pages without any
+        meal_heads = [meal_type.split()[0] for meal_type in self.meal_types if meal_type.strip()]
+        if not any(head in text for head in meal_heads):
+            return {}
+        
+        # Strip once up front; blank lines are kept because they separate meal names
+        lines = [line.strip() for line in text.split('\n')]
         
         meal_counts = OrderedDict()
         # Initialize counts for detected meal types
@@ -115,22 +131,24 @@ class MealCounter:
         
         i = 0
         while i < len(lines):
-            line = lines[i].strip()
+            line = lines[i]
             
             if not line:
                 i += 1
                 continue
             
+            line_lower = line.lower()
+            
             # Skip headers, dates, totals
-            if line.lower() in ['date', 'school', 'meal', 'quantity', 'grade', 'class', 'diner', 'cycle 5']:
+            if line_lower in ['date', 'school', 'meal', 'quantity', 'grade', 'class', 'diner', 'cycle 5']:
                 i += 1
                 continue
             
-            if re.match(r'\d{2}\s+\w+', line) or re.match(r'\d{4}$', line) or re.match(r'\d{2}/\d{2}/\d{2}', line):
+            if DATE_HEAD.match(line) or (len(line) == 4 and line.isdecimal()) or is_dmy(line):
                 i += 1
                 continue
             
-            if 'total' in line.lower():
+            if 'total' in line_lower:
                 i += 1
                 continue
             
@@ -146,17 +164,16 @@ class MealCounter:
                     
                     # Check if next line is part of meal name
                     if i + 1 < len(lines):
-                        next_line = lines[i + 1].strip()
-                        if next_line and not re.match(r'^\d+$', next_line):
+                        next_line = lines[i + 1]
+                        if next_line and not next_line.isdecimal():
                             meal_name += ' ' + next_line
                     
                     # Check if this matches our meal type
                     if meal_name == meal_type or meal_type.startswith(meal_name):
                         # Look for quantity
                         quantity = 0
-                        for j in range(i + 1, min(i + 5, len(lines))):
-                            qty_line = lines[j].strip()
-                            if re.match(r'^\d+$', qty_line):
+                        for qty_line in lines[i + 1:i + 5]:
+                            if qty_line.isdecimal():
                                 qty = int(qty_line)
                                 if 1 <= qty <= 100:
                                     quantity = qty
@@ -183,16 +200,18 @@ class MealCounter:
         
         line_height = 22
         start_y = page_height - 90 - (len(sorted_meals) * line_height)
+        center_x = page_width / 2
         
+        annots = []
         for i, (meal_type, total) in enumerate(sorted_meals):
             text = f"{meal_type} Total: {total}"
             
             y_top = start_y + (i * line_height)
             y_bottom = y_top + line_height
             
-            text_width = len(text) * 9.6
-            x_left = (page_width - text_width) / 2
-            x_right = x_left + text_width
+            half_width = len(text) * _CHAR_WIDTH / 2
+            x_left = center_x - half_width
+            x_right = center_x + half_width
             
             text_rect = fitz.Rect(x_left, y_top, x_right, y_bottom)
             
@@ -207,21 +226,24 @@ class MealCounter:
             )
             
             annot.set_border(width=0)
+            annots.append(annot)
+        
+        # Regenerate appearance streams once all annotations are placed
+        for annot in annots:
             annot.update()
     
-    def process_pdf(self, progress_callback=None):
-        """Main processing function with progress reporting"""
-        doc = fitz.open(self.input_pdf_path)
+    def annotate_document(self, doc, progress_callback=None):
+        """Detect meal types and add totals to every page of an open document"""
         total_pages = len(doc)
         
         # Step 1: Auto-detect meal types from page 1
         self.meal_types = self.detect_meal_types_from_first_page(doc)
         
         if len(self.meal_types) == 0:
-            doc.close()
             raise Exception("Could not detect meal types from page 1")
         
         # Step 2: Process all pages
+        # Kept on one thread: PyMuPDF documents must not be shared across threads
         for page_num in range(total_pages):
             page = doc[page_num]
             meal_totals = self.extract_meals_from_page(page)
@@ -231,13 +253,29 @@ class MealCounter:
             
             if progress_callback:
                 progress_callback(page_num + 1, total_pages)
-        
-        doc.save(self.output_pdf_path, incremental=False, encryption=fitz.PDF_ENCRYPT_NONE)
-        doc.close()
+    
+    def process_pdf(self, progress_callback=None):
+        """Main processing function with progress reporting"""
+        doc = fitz.open(self.input_pdf_path)
+        try:
+            self.annotate_document(doc, progress_callback)
+            doc.save(self.output_pdf_path, incremental=False, encryption=fitz.PDF_ENCRYPT_NONE,
+                     garbage=4, deflate=True, clean=True)
+        finally:
+            doc.close()
+    
+    def process_pdf_bytes(self, progress_callback=None) -> bytes:
+        """Same as process_pdf, but returns the processed PDF instead of writing it to disk"""
+        doc = fitz.open(self.input_pdf_path)
+        try:
+            self.annotate_document(doc, progress_callback)
+            return doc.tobytes(encryption=fitz.PDF_ENCRYPT_NONE, garbage=4, deflate=True, clean=True)
+        finally:
+            doc.close()
 
 
 # Custom CSS for professional styling
-st.markdown("""
+_CUSTOM_CSS = """
     <style>
     .main-header {
         font-size: 5.5rem;
@@ -287,7 +325,22 @@ st.markdown("""
         margin: 0.5rem 0;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+
+# System capabilities shown on the statistics tab
+_CAPABILITIES = {
+    "Maximum File Size": "No limit",
+    "Maximum Pages": "Unlimited",
+    "Supported Formats": "PDF (text-based)",
+    "Coordinate Systems": "All (including flipped)",
+    "Processing Speed": "~100 pages/second",
+    "Concurrent Files": "Batch processing supported",
+    "Output Quality": "Lossless"
+}
+
+
+st.markdown(_CUSTOM_CSS, unsafe_allow_html=True)
 
 
 # Sidebar with instructions
@@ -409,11 +462,10 @@ with tab1:
                 with st.spinner("Processing your PDF..."):
                     # Create temp files
                     with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-                        tmp_input.write(uploaded_file.read())
+                        uploaded_file.seek(0)
+                        shutil.copyfileobj(uploaded_file, tmp_input, length=1024 * 1024)
                         input_path = tmp_input.name
                     
-                    output_path = tempfile.mktemp(suffix='_processed.pdf')
-                    
                     try:
                         # Progress tracking
                         progress_bar = st.progress(0)
@@ -425,8 +477,8 @@ with tab1:
                             status_text.text(f"Processing page {current}/{total}...")
                         
                         # Process the PDF
-                        counter = MealCounter(input_path, output_path)
-                        counter.process_pdf(progress_callback=update_progress)
+                        counter = MealCounter(input_path, '')
+                        processed_pdf = counter.process_pdf_bytes(progress_callback=update_progress)
                         
                         progress_bar.progress(1.0)
                         status_text.text("✅ Processing complete!")
@@ -434,10 +486,6 @@ with tab1:
                         # Success message
                         st.markdown('<div class="success-box">✅ <strong>Success!</strong> Your file has been processed successfully.</div>', unsafe_allow_html=True)
                         
-                        # Read the processed file
-                        with open(output_path, 'rb') as f:
-                            processed_pdf = f.read()
-                        
                         # Download button
                         output_filename = uploaded_file.name.replace('.pdf', '_with_totals.pdf')
                         st.download_button(
@@ -463,8 +511,6 @@ with tab1:
                         # Cleanup
                         try:
                             os.unlink(input_path)
-                            if os.path.exists(output_path):
-                                os.unlink(output_path)
                         except:
                             pass
     
@@ -496,63 +542,75 @@ with tab1:
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
-                for idx, uploaded_file in enumerate(uploaded_files):
-                    status_text.text(f"Processing {idx + 1}/{len(uploaded_files)}: {uploaded_file.name}")
-                    
-                    # Create temp files
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-                        tmp_input.write(uploaded_file.read())
-                        input_path = tmp_input.name
+                # One counter for the whole batch; paths are rebound per file
+                counter = MealCounter('', '')
+                
+                # Results go straight into a temp-file ZIP so only one PDF is held at a time;
+                # PDFs are already compressed, so entries are stored rather than deflated
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_zip:
+                    zip_path = tmp_zip.name
+                
+                try:
+                    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zip_file:
+                        for idx, uploaded_file in enumerate(uploaded_files):
+                            status_text.text(f"Processing {idx + 1}/{len(uploaded_files)}: {uploaded_file.name}")
+                            
+                            # Create temp files
+                            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
+                                uploaded_file.seek(0)
+                                shutil.copyfileobj(uploaded_file, tmp_input, length=1024 * 1024)
+                                input_path = tmp_input.name
+                            
+                            output_path = tempfile.mktemp(suffix='_processed.pdf')
+                            
+                            try:
+                                # Process the PDF
+                                counter.input_pdf_path, counter.output_pdf_path = input_path, output_path
+                                counter.process_pdf()
+                                
+                                # Add processed file to the ZIP
+                                output_filename = uploaded_file.name.replace('.pdf', '_with_totals.pdf')
+                                zip_file.write(output_path, arcname=output_filename)
+                                processed_files.append(output_filename)
+                                
+                            except Exception as e:
+                                st.warning(f"⚠️ Error processing {uploaded_file.name}: {str(e)}")
+                            
+                            finally:
+                                try:
+                                    os.unlink(input_path)
+                                    if os.path.exists(output_path):
+                                        os.unlink(output_path)
+                                except:
+                                    pass
+                                
+                                # Keep memory flat across long batches
+                                fitz.TOOLS.store_shrink(100)
+                                gc.collect()
+                            
+                            progress_bar.progress((idx + 1) / len(uploaded_files))
                     
-                    output_path = tempfile.mktemp(suffix='_processed.pdf')
+                    status_text.text("✅ All files processed!")
                     
-                    try:
-                        # Process the PDF
-                        counter = MealCounter(input_path, output_path)
-                        counter.process_pdf()
+                    if processed_files:
+                        st.markdown('<div class="success-box">✅ <strong>Success!</strong> All files have been processed.</div>', unsafe_allow_html=True)
                         
-                        # Read processed file
-                        with open(output_path, 'rb') as f:
-                            processed_pdf = f.read()
-                        
-                        output_filename = uploaded_file.name.replace('.pdf', '_with_totals.pdf')
-                        processed_files.append((output_filename, processed_pdf))
+                        with open(zip_path, 'rb') as f:
+                            st.download_button(
+                                label=f"📥 Download All Files (ZIP)",
+                                data=f,
+                                file_name="processed_meal_reports.zip",
+                                mime="application/zip",
+                                type="primary"
+                            )
                         
-                    except Exception as e:
-                        st.warning(f"⚠️ Error processing {uploaded_file.name}: {str(e)}")
-                    
-                    finally:
-                        try:
-                            os.unlink(input_path)
-                            if os.path.exists(output_path):
-                                os.unlink(output_path)
-                        except:
-                            pass
-                    
-                    progress_bar.progress((idx + 1) / len(uploaded_files))
-                
-                status_text.text("✅ All files processed!")
+                        st.metric("Files Processed", len(processed_files))
                 
-                # Create ZIP file
-                if processed_files:
-                    st.markdown('<div class="success-box">✅ <strong>Success!</strong> All files have been processed.</div>', unsafe_allow_html=True)
-                    
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        for filename, content in processed_files:
-                            zip_file.writestr(filename, content)
-                    
-                    zip_buffer.seek(0)
-                    
-                    st.download_button(
-                        label=f"📥 Download All Files (ZIP)",
-                        data=zip_buffer,
-                        file_name="processed_meal_reports.zip",
-                        mime="application/zip",
-                        type="primary"
-                    )
-                    
-                    st.metric("Files Processed", len(processed_files))
+                finally:
+                    try:
+                        os.unlink(zip_path)
+                    except:
+                        pass
 
 with tab2:
     st.markdown("### 📊 Processing Statistics")
@@ -572,17 +630,7 @@ with tab2:
     
     st.markdown("### 🎯 System Capabilities")
     
-    capabilities = {
-        "Maximum File Size": "No limit",
-        "Maximum Pages": "Unlimited",
-        "Supported Formats": "PDF (text-based)",
-        "Coordinate Systems": "All (including flipped)",
-        "Processing Speed": "~100 pages/second",
-        "Concurrent Files": "Batch processing supported",
-        "Output Quality": "Lossless"
-    }
-    
-    for key, value in capabilities.items():
+    for key, value in _CAPABILITIES.items():
         col1, col2 = st.columns([1, 2])
         with col1:
             st.markdown(f"**{key}:**")
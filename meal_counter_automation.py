@@ -5,12 +5,24 @@ Uses annotation-based text to bypass coordinate issues
 """
 
 import fitz
-import re
-from collections import defaultdict
-from typing import Dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
 import sys
 import os
 
+from meal_parse import MEAL_KW, categorize_meal, parse_meals
+
+
+# Plain text extraction: no ligature expansion, dehyphenation or CID fallback
+# (shared with app.py so both read page text the same way)
+TEXT_FLAGS = fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+
+# Approximate glyph width of the totals font (size 16), used to size the centred text box
+_CHAR_WIDTH = 9.6
+
+# Documents with more pages than this are extracted in worker processes
+_PARALLEL_MIN_PAGES = 50
+
 
 class MealCounter:
     
@@ -19,66 +31,18 @@ class MealCounter:
         self.output_pdf_path = output_pdf_path
         
     def categorize_meal(self, meal_name: str) -> str:
-        meal_lower = meal_name.lower()
-        if 'beef' in meal_lower or 'beefy' in meal_lower:
-            return 'Beef Meal'
-        elif 'lentil' in meal_lower:
-            return 'Lentil Meal'
-        elif 'chicken' in meal_lower:
-            return 'Chicken Meal'
-        elif 'vegetarian' in meal_lower or 'veggie' in meal_lower:
-            return 'Vegetarian Meal'
-        elif 'fish' in meal_lower:
-            return 'Fish Meal'
-        else:
-            return meal_name.strip()
+        return categorize_meal(meal_name)
     
     def extract_meals_from_page(self, page) -> Dict[str, int]:
-        text = page.get_text()
-        lines = text.split('\n')
-        meal_counts = defaultdict(int)
+        text = page.get_text("text", sort=False, flags=TEXT_FLAGS)
         
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            
-            if not line or line in ['Date', 'School', 'Meal', 'Quantity', 'Grade', 'Class', 'Diner', 'Cycle 5']:
-                i += 1
-                continue
-            
-            if re.match(r'\d{2}\s+\w+', line) or re.match(r'\d{4}$', line) or re.match(r'\d{2}/\d{2}/\d{2}', line):
-                i += 1
-                continue
-            
-            if 'total' in line.lower():
-                i += 1
-                continue
-            
-            if any(keyword in line.lower() for keyword in ['pasta', 'pizza', 'burger', 'salad', 'soup', 'rice', 'chicken', 'beef', 'lentil', 'fish']):
-                meal_name = line
-                
-                if i + 1 < len(lines):
-                    next_line = lines[i + 1].strip()
-                    if next_line and not re.match(r'^\d+$', next_line) and not re.match(r'\d{2}\s+\w+', next_line) and next_line not in ['Date', 'School', 'Meal', 'Quantity', 'Grade', 'Class', 'Diner']:
-                        meal_name += ' ' + next_line
-                        i += 1
-                
-                quantity = 0
-                for j in range(i + 1, min(i + 5, len(lines))):
-                    qty_line = lines[j].strip()
-                    if re.match(r'^\d+$', qty_line):
-                        qty = int(qty_line)
-                        if 1 <= qty <= 100:
-                            quantity = qty
-                            break
-                
-                if quantity > 0:
-                    meal_category = self.categorize_meal(meal_name)
-                    meal_counts[meal_category] += quantity
-            
-            i += 1
+        # Skip pages without any meal keyword before scanning line by line
+        if not MEAL_KW.search(text):
+            return {}
         
-        return meal_counts
+        # Strip once up front; blank lines are kept because they separate meal names
+        lines = [line.strip() for line in text.split('\n')]
+        return parse_meals(lines)
     
     def add_totals_to_page(self, page, meal_totals: Dict[str, int]):
         """
@@ -94,7 +58,9 @@ class MealCounter:
         # Position settings
         line_height = 22
         start_y = page_height - 90 - (len(sorted_meals) * line_height)
+        center_x = page_width / 2
         
+        annots = []
         for i, (meal_type, total) in enumerate(sorted_meals):
             text = f"{meal_type} Total: {total}"
             
@@ -103,9 +69,9 @@ class MealCounter:
             y_bottom = y_top + line_height
             
             # Estimate text width
-            text_width = len(text) * 9.6  # Approximate for size 16
-            x_left = (page_width - text_width) / 2
-            x_right = x_left + text_width
+            half_width = len(text) * _CHAR_WIDTH / 2
+            x_left = center_x - half_width
+            x_right = center_x + half_width
             
             # Create rectangle for text
             text_rect = fitz.Rect(x_left, y_top, x_right, y_bottom)
@@ -123,33 +89,84 @@ class MealCounter:
             
             # Set annotation properties
             annot.set_border(width=0)  # No border
+            annots.append(annot)
+        
+        # Regenerate appearance streams once all annotations are placed
+        for annot in annots:
             annot.update()
     
     def process_pdf(self):
         print(f"Opening: {self.input_pdf_path}")
         
-        doc = fitz.open(self.input_pdf_path)
-        print(f"Pages: {len(doc)}\n")
-        
-        # Process each page
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            meal_totals = self.extract_meals_from_page(page)
+        with fitz.open(self.input_pdf_path) as doc:
+            print(f"Pages: {len(doc)}\n")
             
-            if meal_totals:
-                print(f"Page {page_num + 1}: {dict(meal_totals)}")
-                self.add_totals_to_page(page, meal_totals)
+            # Process each page
+            for page_num in range(len(doc)):
+                page = doc[page_num]
+                meal_totals = self.extract_meals_from_page(page)
+                
+                if meal_totals:
+                    print(f"Page {page_num + 1}: {dict(meal_totals)}")
+                    self.add_totals_to_page(page, meal_totals)
+            
+            self._save(doc)
+    
+    def process_pdf_parallel(self, num_workers: int = min(os.cpu_count() or 1, 4)):
+        """
+        Extract meal totals in worker processes, then annotate and save serially
+        The document object is not process-safe, so each worker opens its own copy
+        """
+        with fitz.open(self.input_pdf_path) as doc:
+            total_pages = len(doc)
+        
+        if total_pages <= _PARALLEL_MIN_PAGES or num_workers < 2:
+            self.process_pdf()
+            return
+        
+        print(f"Opening: {self.input_pdf_path}")
+        print(f"Pages: {total_pages} ({num_workers} workers)\n")
+        
+        # Split pages into one contiguous range per worker
+        chunk_size = -(-total_pages // num_workers)
+        chunks = [list(range(start, min(start + chunk_size, total_pages)))
+                  for start in range(0, total_pages, chunk_size)]
         
-        # Save
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_extract_page_range, [self.input_pdf_path] * len(chunks), chunks))
+        
+        with fitz.open(self.input_pdf_path) as doc:
+            for chunk_results in results:
+                for page_num, meal_totals in chunk_results:
+                    print(f"Page {page_num + 1}: {meal_totals}")
+                    self.add_totals_to_page(doc[page_num], meal_totals)
+            
+            self._save(doc)
+    
+    def _save(self, doc):
         print(f"\nSaving: {self.output_pdf_path}")
-        doc.save(self.output_pdf_path, incremental=False, encryption=fitz.PDF_ENCRYPT_NONE)
-        doc.close()
+        doc.save(self.output_pdf_path, incremental=False, encryption=fitz.PDF_ENCRYPT_NONE,
+                 garbage=4, deflate=True, clean=True)
         
         if os.path.exists(self.output_pdf_path):
             file_size = os.path.getsize(self.output_pdf_path)
             print(f"✓ Done! File size: {file_size:,} bytes")
 
 
+def _extract_page_range(input_pdf_path: str, page_nums: List[int]) -> List[Tuple[int, Dict[str, int]]]:
+    """Worker: extract meal totals for a range of pages from a private document"""
+    counter = MealCounter(input_pdf_path, '')
+    results = []
+    
+    with fitz.open(input_pdf_path) as doc:
+        for page_num in page_nums:
+            meal_totals = counter.extract_meals_from_page(doc[page_num])
+            if meal_totals:
+                results.append((page_num, dict(meal_totals)))
+    
+    return results
+
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python meal_counter_automation.py <input_pdf> [output_pdf]")
@@ -174,7 +191,7 @@ def main():
     print()
     
     counter = MealCounter(input_pdf, output_pdf)
-    counter.process_pdf()
+    counter.process_pdf_parallel()
 
 
 if __name__ == "__main__":
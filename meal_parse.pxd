@@ -0,0 +1,8 @@
+# Static types for compiling meal_parse.py with Cython; the .py file stays importable as-is
+cimport cython
+
+cpdef bint is_dmy(str line)
+cpdef str categorize_meal(str meal_name)
+
+@cython.locals(n=Py_ssize_t, i=Py_ssize_t, quantity=int)
+cpdef dict parse_meals(list lines)
@@ -0,0 +1,98 @@
+"""
+Meal line parsing shared by the command-line counter and the Streamlit app
+meal_counter_automation.py uses the full parser; app.py uses DATE_HEAD and is_dmy
+Plain Python; optionally compiled with Cython (see setup.py and meal_parse.pxd)
+"""
+
+import re
+import sys
+from typing import Dict, List
+
+
+# Line patterns used while scanning page text
+DATE_HEAD = re.compile(r'\d{2}\s+\w+')
+MEAL_KW = re.compile(r'pasta|pizza|burger|salad|soup|rice|chicken|beef|lentil|fish', re.I)
+
+# Table headers that never belong to a meal name
+_HEADER_LINES = frozenset({'Date', 'School', 'Meal', 'Quantity', 'Grade', 'Class', 'Diner'})
+_SKIP_LINES = _HEADER_LINES | {'Cycle 5'}
+
+# Category names are interned so summing per category hits the identity fast path
+BEEF_MEAL = sys.intern('Beef Meal')
+LENTIL_MEAL = sys.intern('Lentil Meal')
+CHICKEN_MEAL = sys.intern('Chicken Meal')
+VEGETARIAN_MEAL = sys.intern('Vegetarian Meal')
+FISH_MEAL = sys.intern('Fish Meal')
+
+
+def is_dmy(line: str) -> bool:
+    """Check whether a line starts with a dd/mm/yy date"""
+    return (len(line) >= 8 and line[2] == '/' and line[5] == '/'
+            and line[:2].isdecimal() and line[3:5].isdecimal() and line[6:8].isdecimal())
+
+
+def categorize_meal(meal_name: str) -> str:
+    # Plain substring checks in priority order; measured faster than a combined regex
+    meal_lower = meal_name.lower()
+    if 'beef' in meal_lower:
+        return BEEF_MEAL
+    elif 'lentil' in meal_lower:
+        return LENTIL_MEAL
+    elif 'chicken' in meal_lower:
+        return CHICKEN_MEAL
+    elif 'vegetarian' in meal_lower or 'veggie' in meal_lower:
+        return VEGETARIAN_MEAL
+    elif 'fish' in meal_lower:
+        return FISH_MEAL
+    else:
+        return meal_name.strip()
+
+
+def parse_meals(lines: List[str]) -> Dict[str, int]:
+    """
+    Sum meal quantities per category from stripped page lines (blank lines included)
+    A meal line may continue on the next line; its quantity follows within 4 lines
+    """
+    meal_counts = {}
+    n = len(lines)
+    
+    i = 0
+    while i < n:
+        line = lines[i]
+        
+        if not line or line in _SKIP_LINES:
+            i += 1
+            continue
+        
+        if DATE_HEAD.match(line) or (len(line) == 4 and line.isdecimal()) or is_dmy(line):
+            i += 1
+            continue
+        
+        if 'total' in line.lower():
+            i += 1
+            continue
+        
+        if MEAL_KW.search(line):
+            meal_name = line
+            
+            if i + 1 < n:
+                next_line = lines[i + 1]
+                if next_line and not next_line.isdecimal() and not DATE_HEAD.match(next_line) and next_line not in _HEADER_LINES:
+                    meal_name += ' ' + next_line
+                    i += 1
+            
+            quantity = 0
+            for qty_line in lines[i + 1:i + 5]:
+                if qty_line.isdecimal():
+                    qty = int(qty_line)
+                    if 1 <= qty <= 100:
+                        quantity = qty
+                        break
+            
+            if quantity > 0:
+                meal_category = categorize_meal(meal_name)
+                meal_counts[meal_category] = meal_counts.get(meal_category, 0) + quantity
+        
+        i += 1
+    
+    return meal_counts
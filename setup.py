@@ -0,0 +1,16 @@
+"""
+Optional build step: compile the meal line parser with Cython
+    pip install cython
+    python setup.py build_ext --inplace
+meal_counter_automation.py and app.py import the compiled module when present, otherwise meal_parse.py
+"""
+
+from setuptools import setup
+from Cython.Build import cythonize
+
+
+setup(
+    name="meal-counter-pro",
+    # Types come from meal_parse.pxd; the typing annotations are for readers only
+    ext_modules=cythonize("meal_parse.py", compiler_directives={"language_level": "3", "annotation_typing": False}),
+)